@@ -48,7 +48,7 @@ if %ERRORLEVEL% EQU 0 (
     echo.
     echo Make sure:
     echo   1. Python is installed on this computer
-    echo   2. Required libraries are installed (pdfplumber, pypdf, openpyxl)
+    echo   2. Required libraries are installed (pymupdf)
     echo   3. batch_process.py is in the same folder as this batch file
     echo.
 )
@@ -7,99 +7,344 @@ Processes multiple PDF files in a folder to:
    sorted alphabetically by the first line of each page
 """
 
-import pdfplumber
-from pypdf import PdfReader, PdfWriter
 import sys
 import os
 import re
-from collections import Counter
-from pathlib import Path
+import json
+import mmap
+import shutil
+import hashlib
+import multiprocessing
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby
+from operator import attrgetter
+
+# Sidecar folder, inside the PDF folder, for page text cached between runs
+CACHE_DIR_NAME = ".pdf_cache"
+
+# Stored with every cache entry; entries with another version are ignored.
+# Bump this whenever the way first/last lines are extracted changes.
+CACHE_VERSION = 3
+
+# Files handed to a scan worker at a time, and how many files a worker may
+# scan before it is replaced by a fresh process. Recycling workers returns
+# any memory held by the PDF library to the OS during long batches.
+SCAN_CHUNKSIZE = 4
+PDFS_PER_WORKER = 8
+
+# Number of source PDFs the merge step reads ahead on background threads
+READ_AHEAD = 16
+
+# One page of the combined PDF: casefolded first line (the sort key) and
+# where to find the page. A namedtuple is much smaller than a dict per page.
+PageEntry = namedtuple('PageEntry', 'key path source page_num')
+
+# Compiled once at import; matches "xxx MM/DD/YY cccc" and captures xxx
+_CODE_RE = re.compile(r'^([a-zA-Z0-9]{3})\s+\d{1,2}/\d{1,2}/\d{2,4}\s+[a-zA-Z]{4}\s*$')
+
+@lru_cache(maxsize=None)
+def _pymupdf():
+    """
+    Import PyMuPDF on first use, so usage and argument errors print
+    without waiting for the library to load.
+    """
+    import pymupdf
+    return pymupdf
 
 def extract_three_letter_code(line):
     """
     Extract the three-letter code from a line.
     Expected format: "xxx MM/DD/YY cccc"
+    The line must already be stripped of surrounding whitespace.
     """
-    pattern = r'^([a-zA-Z0-9]{3})\s+\d{1,2}/\d{1,2}/\d{2,4}\s+[a-zA-Z]{4}\s*$'
-    match = re.match(pattern, line.strip())
+    # Most lines are not codes, so reject them with cheap checks before the
+    # regex runs. The shortest possible match, "xxx M/D/YY cccc", is 15 chars.
+    if len(line) < 15 or not line[3:4].isspace() or '/' not in line:
+        return None
+    
+    match = _CODE_RE.match(line)
     if match:
         return match.group(1)
     return None
 
+def _page_words(page):
+    """
+    Get the words on a page.
+    
+    Args:
+        page: PyMuPDF page object
+        
+    Returns:
+        List of (x0, y0, x1, y1, word, block_no, line_no, word_no) tuples
+    """
+    return page.get_text("words")
+
+def _line_text(words, anchor):
+    """
+    Join the words on the same line as `anchor`, left to right.
+    MuPDF puts fields that sit far apart on one baseline into separate
+    blocks, so a line is every word whose vertical middle falls within
+    the anchor word's height, whatever block it is in.
+    """
+    top, bottom = anchor[1], anchor[3]
+    line = [w for w in words if top <= (w[1] + w[3]) / 2 <= bottom]
+    line.sort(key=lambda w: w[0])
+    return " ".join(w[4] for w in line)
+
+def _first_line(words):
+    """Return the first line of the words from _page_words, or ''."""
+    if words:
+        # The word with the highest top edge is on the first line
+        return _line_text(words, min(words, key=lambda w: w[1]))
+    return ""
+
+def _last_line(words):
+    """Return the last line of the words from _page_words, or ''."""
+    if words:
+        # The word with the lowest bottom edge is on the last line
+        return _line_text(words, max(words, key=lambda w: w[3]))
+    return ""
+
 def get_first_line(page):
     """
     Extract the first non-empty line from a page.
     
     Args:
-        page: pdfplumber page object
+        page: PyMuPDF page object
         
     Returns:
         First non-empty line as string, or empty string if none found
     """
-    text = page.extract_text()
-    if text:
-        lines = text.split('\n')
-        for line in lines:
-            if line.strip():
-                return line.strip()
-    return ""
+    return _first_line(_page_words(page))
+
+def _read_file(path):
+    """Return the raw bytes of a file."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def clear_page_cache(folder_path):
+    """
+    Delete the cached page text for a folder so every PDF is parsed again.
+    
+    Args:
+        folder_path: Path to the folder containing PDFs
+    """
+    shutil.rmtree(os.path.join(folder_path, CACHE_DIR_NAME), ignore_errors=True)
+
+def _load_cached_lines(cache_file):
+    """Return the cached (first_line, last_line) list for a PDF, or None."""
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cached = json.load(f)
+        if (cached.get('version') == CACHE_VERSION
+                and len(cached['pages']) == cached['page_count']):
+            return [tuple(lines) for lines in cached['pages']]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Missing or unreadable cache entry - parse the PDF
+    return None
+
+def _store_cached_lines(cache_file, page_lines):
+    """Write a PDF's (first_line, last_line) list to its cache entry."""
+    # A cache that cannot be written only costs a re-parse next run.
+    # Write to a per-process temp file first so readers never see half a file.
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'page_count': len(page_lines),
+                       'pages': page_lines}, f)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+def _prune_page_cache(folder_path, keep):
+    """
+    Delete cache entries for PDFs that are no longer in the folder, so the
+    cache does not keep growing as old PDFs are replaced by new ones.
+    
+    Args:
+        folder_path: Path to the folder containing PDFs
+        keep: Set of cache file names used by the current run
+    """
+    try:
+        with os.scandir(os.path.join(folder_path, CACHE_DIR_NAME)) as entries:
+            stale = [e.path for e in entries if e.name not in keep]
+    except OSError:
+        return  # No cache folder yet
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Another run may still be using it; try again next time
+
+def _read_page_lines(path_str):
+    """
+    Get the first and last non-empty line of each page of one PDF.
+    Results are cached in the folder's CACHE_DIR_NAME directory, keyed by
+    the MD5 of the file contents, so unchanged PDFs are not parsed again.
+    
+    Args:
+        path_str: Path to the PDF file
+        
+    Returns:
+        Tuple of (cache file name, list of (first_line, last_line) tuples,
+        one per page)
+    """
+    cache_dir = os.path.join(os.path.dirname(path_str), CACHE_DIR_NAME)
+    
+    # Memory-map the file: it is hashed and, on a cache miss, parsed straight
+    # from the OS page cache without copying it into Python bytes first.
+    # The map stays open until PyMuPDF is done with it.
+    with open(path_str, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        cache_name = f"{hashlib.md5(mm).hexdigest()}.json"
+        cache_file = os.path.join(cache_dir, cache_name)
+        
+        page_lines = _load_cached_lines(cache_file)
+        if page_lines is not None:
+            return cache_name, page_lines
+        
+        with memoryview(mm) as view:
+            doc = _pymupdf().open(stream=view, filetype="pdf")
+            try:
+                page_lines = []
+                for page in doc:
+                    words = _page_words(page)
+                    page_lines.append((_first_line(words), _last_line(words)))
+            finally:
+                doc.close()
+                del doc
+    
+    _store_cached_lines(cache_file, page_lines)
+    return cache_name, page_lines
+
+def _scan_pdf(path_str):
+    """
+    Get the first and last line of each page of one PDF.
+    Runs in a worker process, so errors are returned instead of printed.
+    
+    Args:
+        path_str: Path to the PDF file (as a string, so it pickles cheaply)
+        
+    Returns:
+        Tuple of (list of (first_line, last_line, page_index) tuples,
+        cache file name or None, error message or None)
+    """
+    try:
+        cache_name, page_lines = _read_page_lines(path_str)
+        return [(first_line, last_line, page_index)
+                for page_index, (first_line, last_line) in enumerate(page_lines)], cache_name, None
+    except Exception as e:
+        return [], None, str(e)
 
-def count_codes_in_folder(folder_path, verbose=False):
+def _scan_folder(folder_path):
+    """
+    Read every PDF in a folder once, in parallel worker processes.
+    The result is shared by count_codes_in_folder and
+    combine_pdfs_alphabetically so no PDF is parsed twice.
+    
+    Args:
+        folder_path: Path to the folder containing PDFs
+        
+    Returns:
+        List of (pdf_path, page_lines, error) tuples in file name order,
+        where page_lines and error are as returned by _scan_pdf
+    """
+    # os.scandir gives names without building a Path per entry
+    with os.scandir(folder_path) as entries:
+        pdf_paths = [e.path for e in entries
+                     if e.name.lower().endswith('.pdf') and e.is_file()]
+    pdf_paths.sort(key=os.path.normcase)
+    
+    if not pdf_paths:
+        _prune_page_cache(folder_path, set())
+        return []
+    
+    # pool.map keeps results in file order so ties sort the same way every run.
+    # maxtasksperchild counts chunks, not files.
+    processes = min(multiprocessing.cpu_count(), len(pdf_paths))
+    tasks_per_child = max(1, PDFS_PER_WORKER // SCAN_CHUNKSIZE)
+    with multiprocessing.Pool(processes, maxtasksperchild=tasks_per_child) as pool:
+        scans = pool.map(_scan_pdf, pdf_paths, chunksize=SCAN_CHUNKSIZE)
+    
+    _prune_page_cache(folder_path, {cache_name for _, cache_name, _ in scans})
+    
+    return [(pdf_path, page_lines, error)
+            for pdf_path, (page_lines, _, error) in zip(pdf_paths, scans)]
+
+def _read_ahead(paths, depth=READ_AHEAD):
+    """
+    Read files on background threads, at most `depth` files ahead.
+    This hides open/read latency (e.g. on network folders) while the caller
+    works on the previous file, without holding every file in memory.
+    
+    Args:
+        paths: Paths of the files to read, in the order they are needed
+        depth: Maximum number of files read ahead of the caller
+        
+    Yields:
+        Future for each path, in order; result() returns the file bytes
+        or raises the error from reading it
+    """
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(_read_file, path))
+            if len(pending) >= depth:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+def count_codes_in_folder(folder_path, verbose=False, scanned_pdfs=None):
     """
     Count three-letter codes from all PDFs in a folder.
     
     Args:
         folder_path: Path to the folder containing PDFs
         verbose: If True, print details about each file
+        scanned_pdfs: Result of _scan_folder(folder_path), if already available
         
     Returns:
         Counter object with code counts
     """
     code_counter = Counter()
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
     
-    if not pdf_files:
+    if scanned_pdfs is None:
+        scanned_pdfs = _scan_folder(folder_path)
+    
+    if not scanned_pdfs:
         print(f"No PDF files found in {folder_path}")
         return code_counter
     
-    print(f"Found {len(pdf_files)} PDF file(s)")
+    print(f"Found {len(scanned_pdfs)} PDF file(s)")
     print("=" * 80)
     
-    for pdf_file in sorted(pdf_files):
-        print(f"\nProcessing: {pdf_file.name}")
+    for pdf_path, page_lines, error in scanned_pdfs:
+        file_name = os.path.basename(pdf_path)
+        print(f"\nProcessing: {file_name}")
         
-        try:
-            with pdfplumber.open(pdf_file) as pdf:
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    text = page.extract_text()
-                    
-                    if text:
-                        lines = text.split('\n')
-                        
-                        # Get last non-empty line
-                        last_line = None
-                        for line in reversed(lines):
-                            if line.strip():
-                                last_line = line.strip()
-                                break
-                        
-                        if last_line:
-                            code = extract_three_letter_code(last_line)
-                            
-                            if code:
-                                code_counter[code] += 1
-                                if verbose:
-                                    print(f"  Page {page_num}: Found code '{code}'")
-                            elif verbose:
-                                print(f"  Page {page_num}: No code found in: {last_line}")
+        if error:
+            print(f"  Error processing {file_name}: {error}")
+            continue
         
-        except Exception as e:
-            print(f"  Error processing {pdf_file.name}: {e}")
+        for _, last_line, page_index in page_lines:
+            page_num = page_index + 1
+            
+            if last_line:
+                code = extract_three_letter_code(last_line)
+                
+                if code:
+                    code_counter[code] += 1
+                    if verbose:
+                        print(f"  Page {page_num}: Found code '{code}'")
+                elif verbose:
+                    print(f"  Page {page_num}: No code found in: {last_line}")
     
     print("=" * 80)
     return code_counter
 
-def combine_pdfs_alphabetically(folder_path, output_path, verbose=False):
+def combine_pdfs_alphabetically(folder_path, output_path, verbose=False, scanned_pdfs=None):
     """
     Combine PDFs from a folder, sorted alphabetically by first line of each page.
     Excludes files with "multi-page" in the filename.
@@ -108,71 +353,99 @@ def combine_pdfs_alphabetically(folder_path, output_path, verbose=False):
         folder_path: Path to the folder containing PDFs
         output_path: Path for the output combined PDF
         verbose: If True, print details about each page
+        scanned_pdfs: Result of _scan_folder(folder_path), if already available
         
     Returns:
         Number of pages in combined PDF
     """
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
+    if scanned_pdfs is None:
+        scanned_pdfs = _scan_folder(folder_path)
     
     # Filter out files with "multi-page" in the name
-    pdf_files = [f for f in pdf_files if "multi-page" not in f.name.lower()]
+    scanned_pdfs = [s for s in scanned_pdfs if "multi-page" not in os.path.basename(s[0]).lower()]
     
-    if not pdf_files:
+    if not scanned_pdfs:
         print("No PDF files to combine (after filtering)")
         return 0
     
-    print(f"\nCombining {len(pdf_files)} PDF file(s) (excluding 'multi-page' files)")
+    print(f"\nCombining {len(scanned_pdfs)} PDF file(s) (excluding 'multi-page' files)")
     print("=" * 80)
     
-    # Store pages with their first line for sorting
+    # Store only the sort key and where each page lives. Source PDFs are
+    # opened later with PyMuPDF from the read-ahead bytes, one at a time,
+    # so only one source document is open at once.
     pages_with_keys = []
     
-    for pdf_file in sorted(pdf_files):
+    for pdf_path, page_lines, error in scanned_pdfs:
+        file_name = os.path.basename(pdf_path)
         if verbose:
-            print(f"Reading: {pdf_file.name}")
+            print(f"Reading: {file_name}")
         
-        try:
-            # Use pdfplumber to extract text for sorting
-            with pdfplumber.open(pdf_file) as plumber_pdf:
-                # Use pypdf to get the actual pages for combining
-                pypdf_reader = PdfReader(pdf_file)
-                
-                for page_num, plumber_page in enumerate(plumber_pdf.pages):
-                    first_line = get_first_line(plumber_page)
-                    pypdf_page = pypdf_reader.pages[page_num]
-                    
-                    pages_with_keys.append({
-                        'first_line': first_line,
-                        'page': pypdf_page,
-                        'source': pdf_file.name,
-                        'page_num': page_num + 1
-                    })
-                    
-                    if verbose:
-                        print(f"  Page {page_num + 1}: '{first_line[:50]}...'")
+        if error:
+            print(f"Error reading {file_name}: {error}")
+            continue
         
-        except Exception as e:
-            print(f"Error reading {pdf_file.name}: {e}")
+        for first_line, _, page_index in page_lines:
+            pages_with_keys.append(PageEntry(
+                key=first_line.casefold(),
+                path=pdf_path,
+                source=file_name,
+                page_num=page_index + 1
+            ))
+            
+            if verbose:
+                print(f"  Page {page_index + 1}: '{first_line[:50]}...'")
     
-    # Sort pages alphabetically by first line (case-insensitive)
-    pages_with_keys.sort(key=lambda x: x['first_line'].lower())
+    # Sort pages alphabetically by first line (case-insensitive). The key was
+    # stored with each page, so sorting needs no Python-level key function.
+    pages_with_keys.sort(key=attrgetter('key'))
     
     print(f"\nSorted {len(pages_with_keys)} pages alphabetically by first line")
     
     # Create the combined PDF
-    writer = PdfWriter()
+    out_doc = _pymupdf().open()
+    num_pages = 0
     
-    for item in pages_with_keys:
-        writer.add_page(item['page'])
+    # Consecutive pages from the same source share one open document, which
+    # is closed before the next source is opened
+    runs = [(pdf_path, list(items))
+            for pdf_path, items in groupby(pages_with_keys, key=attrgetter('path'))]
+    pdf_bytes = _read_ahead([pdf_path for pdf_path, _ in runs])
     
-    # Write the output
-    with open(output_path, 'wb') as output_file:
-        writer.write(output_file)
+    for (pdf_path, items), data in zip(runs, pdf_bytes):
+        try:
+            # insert_pdf copies pages inside MuPDF rather than rebuilding
+            # each page's objects in Python
+            src_doc = _pymupdf().open(stream=data.result(), filetype="pdf")
+            try:
+                for item in items:
+                    page_index = item.page_num - 1
+                    out_doc.insert_pdf(src_doc, from_page=page_index, to_page=page_index)
+                    num_pages += 1
+            finally:
+                src_doc.close()
+        
+        except Exception as e:
+            print(f"Error reading {items[0].source}: {e}")
+    
+    # PyMuPDF cannot save a document with no pages, e.g. when every source
+    # PDF failed to read
+    if num_pages == 0:
+        out_doc.close()
+        print("No pages to combine; combined PDF not written")
+        print("=" * 80)
+        return 0
+    
+    # Write the output, dropping unused and duplicate objects
+    try:
+        out_doc.save(output_path, garbage=4, deflate=True)
+    finally:
+        out_doc.close()
     
     print(f"Combined PDF saved to: {output_path}")
     print("=" * 80)
     
-    return len(pages_with_keys)
+    return num_pages
 
 def print_code_results(code_counter):
     """Print the code counting results in a formatted way."""
@@ -195,31 +468,38 @@ def print_code_results(code_counter):
         print(f"  {code}: {code_counter[code]}")
 
 def main():
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: python batch_process.py <folder_path> [--verbose]")
+    if len(sys.argv) < 2 or len(sys.argv) > 4:
+        print("Usage: python batch_process.py <folder_path> [--verbose] [--force-refresh]")
         print("\nThis script will:")
         print("  1. Count three-letter codes from all PDFs in the folder")
         print("  2. Combine PDFs (excluding 'multi-page' files) sorted by first line")
         print("\nOptions:")
-        print("  --verbose  Show detailed processing information")
+        print("  --verbose        Show detailed processing information")
+        print("  --force-refresh  Re-read every PDF instead of using cached page text")
         print("\nExample:")
         print("  python batch_process.py /path/to/pdf/folder")
         print("  python batch_process.py ./pdfs --verbose")
         sys.exit(1)
     
     folder_path = sys.argv[1]
-    verbose = len(sys.argv) == 3 and sys.argv[2] == "--verbose"
+    verbose = "--verbose" in sys.argv[2:]
+    force_refresh = "--force-refresh" in sys.argv[2:]
     
     # Verify folder exists
     if not os.path.isdir(folder_path):
         print(f"Error: '{folder_path}' is not a valid directory")
         sys.exit(1)
     
+    if force_refresh:
+        clear_page_cache(folder_path)
+    
     # Count codes from all PDFs
     print("\n" + "=" * 80)
     print("STEP 1: Counting three-letter codes from all PDFs")
     print("=" * 80)
-    code_counter = count_codes_in_folder(folder_path, verbose)
+    # Read every PDF once; both steps use the same scan
+    scanned_pdfs = _scan_folder(folder_path)
+    code_counter = count_codes_in_folder(folder_path, verbose, scanned_pdfs)
     print_code_results(code_counter)
     
     # Combine PDFs
@@ -227,14 +507,15 @@ def main():
     print("STEP 2: Combining PDFs alphabetically")
     print("=" * 80)
     output_path = os.path.join(folder_path, "combined_alphabetical.pdf")
-    num_pages = combine_pdfs_alphabetically(folder_path, output_path, verbose)
+    num_pages = combine_pdfs_alphabetically(folder_path, output_path, verbose, scanned_pdfs)
     
     print(f"\n{'=' * 80}")
     print("COMPLETE!")
     print(f"{'=' * 80}")
     print(f"Total codes counted: {sum(code_counter.values())}")
     print(f"Combined PDF pages: {num_pages}")
-    print(f"Output file: {output_path}")
+    if num_pages:
+        print(f"Output file: {output_path}")
 
 if __name__ == "__main__":
     main()
@@ -8,6 +8,7 @@ Processes multiple PDF files in a folder to:
 """
 
 import pdfplumber
+import logging
 from pypdf import PdfReader, PdfWriter
 import sys
 import os
@@ -15,6 +16,11 @@ import re
 from collections import Counter
 from pathlib import Path
 
+# pdfminer (used by pdfplumber) logs warnings for many real-world PDFs;
+# handling them is slow and only clutters the output
+for _logger_name in ("pdfminer", "pdfplumber"):
+    logging.getLogger(_logger_name).setLevel(logging.ERROR)
+
 def extract_three_letter_code(line):
     """
     Extract the three-letter code from a line.
@@ -7,109 +7,299 @@ Processes multiple PDF files in a folder to:
    sorted alphabetically by the first line of each page
 """
 
-import pdfplumber
+import pymupdf
 from pypdf import PdfReader, PdfWriter
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
+import xlsxwriter
 import sys
 import os
-import re
-from collections import Counter
-from pathlib import Path
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import attrgetter
+
+# Height of the band at the top/bottom of a page, as a fraction of the page,
+# searched for the first/last line before falling back to the whole page
+LINE_BAND_FRACTION = 0.12
+
+# Upper bound on the worker processes used to read PDFs
+MAX_WORKERS = 8
+
+# One page of the combined PDF: its sort key (bucket 0 for codes that occur
+# once, else 1, then the lowercased code) and where the page comes from.
+# A namedtuple is much smaller than a dict per page.
+PageRec = namedtuple('PageRec', 'sort_bucket code_key page reader source page_num')
 
 def extract_three_letter_code(line):
     """
     Extract the three-letter code from a line.
     Expected format: "xxx MM/DD/YY cccc"
     """
-    pattern = r'^([a-zA-Z0-9]{3})\s+\d{1,2}/\d{1,2}/\d{2,4}\s+[a-zA-Z]{4}\s*$'
-    match = re.match(pattern, line.strip())
-    if match:
-        return match.group(1)
-    return None
+    # Most lines are not codes, so reject them with cheap checks first.
+    # The shortest possible match, "xxx M/D/YY cccc", is 15 chars.
+    line = line.strip()
+    if len(line) < 15 or '/' not in line:
+        return None
+    
+    # The layout is fixed, so check it field by field rather than with a regex
+    parts = line.split()
+    if len(parts) != 3:
+        return None
+    
+    code, date, tail = parts
+    if len(code) != 3 or not (code.isascii() and code.isalnum()):
+        return None
+    if len(tail) != 4 or not (tail.isascii() and tail.isalpha()):
+        return None
+    
+    # Month and day are 1-2 digits, the year 2-4 digits
+    fields = date.split('/')
+    if len(fields) != 3:
+        return None
+    month, day, year = fields
+    if not (1 <= len(month) <= 2 and 1 <= len(day) <= 2 and 2 <= len(year) <= 4):
+        return None
+    if not (month.isdecimal() and day.isdecimal() and year.isdecimal()):
+        return None
+    return code
+
+def _line_words(words, last):
+    """
+    Pick out the words of the first or last line from PyMuPDF words.
+    MuPDF puts fields that sit far apart on one baseline into separate
+    blocks, so a line is every word whose vertical middle falls within the
+    highest (or lowest) word, whatever block it is in.
+    
+    Args:
+        words: (x0, y0, x1, y1, word, ...) tuples from get_text("words")
+        last: If True, take the last line; otherwise the first
+        
+    Returns:
+        Word tuples of the line, left to right (empty if there are no words)
+    """
+    if not words:
+        return []
+    if last:
+        anchor = max(words, key=lambda w: w[3])
+    else:
+        anchor = min(words, key=lambda w: w[1])
+    line = [w for w in words if anchor[1] <= (w[1] + w[3]) / 2 <= anchor[3]]
+    line.sort(key=lambda w: w[0])
+    return line
+
+def get_band_line(page, top):
+    """
+    Extract the first or last line of a page, looking only in a band
+    across the top or bottom of the page when possible.
+    Decoding only the band is much cheaper than extracting the full page.
+    
+    Args:
+        page: PyMuPDF page object
+        top: If True, return the first line from the top band; otherwise
+            the last line from the bottom band
+        
+    Returns:
+        The line's words joined by spaces, or empty string if the page
+        has no text
+    """
+    rect = page.rect
+    band_height = rect.height * LINE_BAND_FRACTION
+    if top:
+        clip = pymupdf.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + band_height)
+    else:
+        clip = pymupdf.Rect(rect.x0, rect.y1 - band_height, rect.x1, rect.y1)
+    
+    line = _line_words(page.get_text("words", clip=clip), last=not top)
+    
+    # The clip keeps or drops each character separately, so a line that
+    # crosses the band's inner edge comes back in pieces. If the line found
+    # is within its own height of that edge, it may be such a line; read
+    # the whole page instead, as when the band is empty.
+    read_page = not line
+    if line:
+        line_top = min(w[1] for w in line)
+        line_bottom = max(w[3] for w in line)
+        line_height = line_bottom - line_top
+        if top:
+            read_page = clip.y1 - line_bottom <= line_height
+        else:
+            read_page = line_top - clip.y0 <= line_height
+    if read_page:
+        line = _line_words(page.get_text("words"), last=not top)
+    return " ".join(w[4] for w in line)
 
 def get_first_line(page):
     """
     Extract the first non-empty line from a page.
     
     Args:
-        page: pdfplumber page object
+        page: PyMuPDF page object
         
     Returns:
         First non-empty line as string, or empty string if none found
     """
-    text = page.extract_text()
-    if text:
-        lines = text.split('\n')
-        for line in lines:
-            if line.strip():
-                return line.strip()
-    return ""
+    return get_band_line(page, top=True)
 
-def count_codes_in_folder(folder_path, verbose=False):
+def get_last_line(page):
     """
-    Count three-letter codes from all PDFs in a folder.
+    Extract the last non-empty line from a page.
+    
+    Args:
+        page: PyMuPDF page object
+        
+    Returns:
+        Last non-empty line as string, or empty string if none found
+    """
+    return get_band_line(page, top=False)
+
+def _process_one_pdf(pdf_path):
+    """
+    Extract the last line and three-letter code of every page of one PDF.
+    Runs in a worker process, so only plain picklable data is returned.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        
+    Returns:
+        Tuple of (list of (code, last_line) per page, error message or None)
+    """
+    page_codes = []
+    try:
+        doc = pymupdf.open(pdf_path)
+        try:
+            # Load pages by index and drop each one as soon as it is read,
+            # so MuPDF can free the page before the next is loaded
+            for page_index in range(doc.page_count):
+                page = doc.load_page(page_index)
+                last_line = get_last_line(page)
+                page = None
+                code = extract_three_letter_code(last_line) if last_line else None
+                page_codes.append((code, last_line))
+        finally:
+            doc.close()
+    except Exception as e:
+        return page_codes, str(e)
+    return page_codes, None
+
+def discover_pdfs(folder_path):
+    """
+    List the PDFs in a folder once, for every later step to share.
     
     Args:
         folder_path: Path to the folder containing PDFs
-        verbose: If True, print details about each file
         
     Returns:
-        Counter object with code counts
+        Tuple of (all PDF paths, paths of PDFs to combine), both sorted.
+        Files with "multi-page" in the filename are not combined.
+    """
+    # scandir() gives each entry's name without a stat or Path object per file
+    with os.scandir(folder_path) as entries:
+        all_pdfs = sorted((e.path for e in entries
+                           if e.is_file() and e.name.lower().endswith('.pdf')),
+                          key=os.path.normcase)
+    
+    combinable_pdfs = [p for p in all_pdfs
+                       if "multi-page" not in os.path.basename(p).lower()]
+    return all_pdfs, combinable_pdfs
+
+def collect_pages(pdf_files, combinable_pdfs, readers, verbose=False):
     """
-    code_counter = Counter()
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
+    Read every PDF once, extracting the three-letter code from the last
+    line of each page. Text extraction runs in a pool of worker
+    processes; pages of files that will be combined also carry their pypdf
+    page, read here, so combining does not need to reopen any PDF.
     
+    Args:
+        pdf_files: Sorted paths of all PDFs to read
+        combinable_pdfs: Paths of the PDFs that will be combined
+        readers: Dict of pypdf readers by path, filled in as files are opened
+        verbose: If True, print details about each file
+        
+    Returns:
+        List of dicts with 'code', 'page', 'reader', 'source' and 'page_num'
+        keys. 'page' and 'reader' are None for pages that are counted but
+        not combined, including pages pypdf could not read.
+    """
+    pages = []
     if not pdf_files:
-        print(f"No PDF files found in {folder_path}")
-        return code_counter
+        return pages
     
+    combinable_pdfs = set(combinable_pdfs)
     print(f"Found {len(pdf_files)} PDF file(s)")
     print("=" * 80)
     
-    for pdf_file in sorted(pdf_files):
-        print(f"\nProcessing: {pdf_file.name}")
+    workers = min(os.cpu_count() or 1, MAX_WORKERS)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in file order, so output stays sorted
+        results = executor.map(_process_one_pdf, pdf_files)
         
-        try:
-            with pdfplumber.open(pdf_file) as pdf:
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    text = page.extract_text()
-                    
-                    if text:
-                        lines = text.split('\n')
-                        
-                        # Get last non-empty line
-                        last_line = None
-                        for line in reversed(lines):
-                            if line.strip():
-                                last_line = line.strip()
-                                break
-                        
-                        if last_line:
-                            code = extract_three_letter_code(last_line)
-                            
-                            if code:
-                                code_counter[code] += 1
-                                if verbose:
-                                    print(f"  Page {page_num}: Found code '{code}'")
-                            elif verbose:
-                                print(f"  Page {page_num}: No code found in: {last_line}")
-        
-        except Exception as e:
-            print(f"  Error processing {pdf_file.name}: {e}")
+        for pdf_file, (page_codes, error) in zip(pdf_files, results):
+            name = os.path.basename(pdf_file)
+            # Messages for a file are buffered and printed in one call, so
+            # verbose runs don't pay for a print() per page
+            messages = [f"\nProcessing: {name}"]
+            combine = pdf_file in combinable_pdfs
+            
+            # Use pypdf to get the actual pages for combining, keeping a
+            # single reader per file for the rest of the run. A pypdf failure
+            # only keeps pages out of the combined PDF; their codes still count.
+            pypdf_reader = None
+            pypdf_page_count = 0
+            combine_error = None
+            if combine and page_codes:
+                try:
+                    pypdf_reader = readers.get(pdf_file)
+                    if pypdf_reader is None:
+                        pypdf_reader = readers[pdf_file] = PdfReader(pdf_file, strict=False)
+                    pypdf_page_count = len(pypdf_reader.pages)
+                except Exception as e:
+                    pypdf_reader = None
+                    combine_error = str(e)
+                
+                if pypdf_reader is not None and pypdf_page_count < len(page_codes):
+                    combine_error = (f"pypdf found {pypdf_page_count} of "
+                                     f"{len(page_codes)} pages")
+            
+            for page_num, (code, last_line) in enumerate(page_codes, start=1):
+                if verbose:
+                    if code:
+                        messages.append(f"  Page {page_num}: Found code '{code}'")
+                    elif last_line:
+                        messages.append(f"  Page {page_num}: No code found in: {last_line}")
+                
+                page = None
+                if pypdf_reader is not None and page_num <= pypdf_page_count:
+                    try:
+                        page = pypdf_reader.pages[page_num - 1]
+                    except Exception as e:
+                        combine_error = str(e)
+                
+                pages.append({
+                    'code': code,
+                    'page': page,
+                    'reader': pypdf_reader if page is not None else None,
+                    'source': name,
+                    'page_num': page_num
+                })
+            
+            if error:
+                messages.append(f"  Error processing {name}: {error}")
+            if combine_error:
+                messages.append(f"  Error reading {name} for combining: {combine_error}")
+            print("\n".join(messages))
     
     print("=" * 80)
-    return code_counter
+    return pages
 
-def combine_pdfs_alphabetically(folder_path, output_path, code_counter, verbose=False):
+def combine_pdfs_alphabetically(pages, combinable_pdfs, output_path, code_counter, verbose=False):
     """
-    Combine PDFs from a folder, sorted alphabetically by 3-character code.
+    Combine pages collected from a folder, sorted alphabetically by 3-character code.
     Pages with code count of 1 appear first, then pages with higher counts.
     Both groups are sorted alphabetically by code.
     Excludes files with "multi-page" in the filename.
     
     Args:
-        folder_path: Path to the folder containing PDFs
+        pages: Page dicts returned by collect_pages
+        combinable_pdfs: Paths of the PDFs to combine
         output_path: Path for the output combined PDF
         code_counter: Counter object with code counts
         verbose: If True, print details about each page
@@ -117,82 +307,72 @@ def combine_pdfs_alphabetically(folder_path, output_path, code_counter, verbose=
     Returns:
         Number of pages in combined PDF
     """
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
-    
-    # Filter out files with "multi-page" in the name
-    pdf_files = [f for f in pdf_files if "multi-page" not in f.name.lower()]
-    
-    if not pdf_files:
+    if not combinable_pdfs:
         print("No PDF files to combine (after filtering)")
         return 0
     
-    print(f"\nCombining {len(pdf_files)} PDF file(s) (excluding 'multi-page' files)")
+    print(f"\nCombining {len(combinable_pdfs)} PDF file(s) (excluding 'multi-page' files)")
     print("=" * 80)
     
-    # Store pages with their code for sorting
+    # Pages from "multi-page" files were only read for counting
+    pages = [p for p in pages if p['page'] is not None]
+    
+    # Store pages with their sort key precomputed
     pages_with_keys = []
+    messages = []
+    source = None
     
-    for pdf_file in sorted(pdf_files):
-        if verbose:
-            print(f"Reading: {pdf_file.name}")
+    for item in pages:
+        if verbose and item['source'] != source:
+            source = item['source']
+            messages.append(f"Reading: {source}")
         
-        try:
-            # Use pdfplumber to extract text for sorting
-            with pdfplumber.open(pdf_file) as plumber_pdf:
-                # Use pypdf to get the actual pages for combining
-                pypdf_reader = PdfReader(pdf_file)
-                
-                for page_num, plumber_page in enumerate(plumber_pdf.pages):
-                    # Get the last line to extract the code
-                    text = plumber_page.extract_text()
-                    code = None
-                    
-                    if text:
-                        lines = text.split('\n')
-                        # Get last non-empty line
-                        for line in reversed(lines):
-                            if line.strip():
-                                code = extract_three_letter_code(line.strip())
-                                break
-                    
-                    pypdf_page = pypdf_reader.pages[page_num]
-                    
-                    # Get the count for this code
-                    code_count = code_counter.get(code, 0) if code else 0
-                    
-                    pages_with_keys.append({
-                        'code': code if code else '',
-                        'code_count': code_count,
-                        'page': pypdf_page,
-                        'source': pdf_file.name,
-                        'page_num': page_num + 1
-                    })
-                    
-                    if verbose:
-                        print(f"  Page {page_num + 1}: Code '{code}' (count: {code_count})")
+        code = item['code']
+        
+        # Get the count for this code
+        code_count = code_counter.get(code, 0) if code else 0
+        
+        pages_with_keys.append(PageRec(
+            sort_bucket=0 if code_count == 1 else 1,
+            code_key=code.lower() if code else '',
+            page=item['page'],
+            reader=item['reader'],
+            source=item['source'],
+            page_num=item['page_num']
+        ))
         
-        except Exception as e:
-            print(f"Error reading {pdf_file.name}: {e}")
+        if verbose:
+            messages.append(f"  Page {item['page_num']}: Code '{code}' (count: {code_count})")
+    
+    if messages:
+        print("\n".join(messages))
     
     # Sort pages: first by whether count is 1 (single occurrences first),
     # then alphabetically by code (case-insensitive)
-    pages_with_keys.sort(key=lambda x: (0 if x['code_count'] == 1 else 1, x['code'].lower()))
+    pages_with_keys.sort(key=attrgetter('sort_bucket', 'code_key'))
     
-    single_count = sum(1 for x in pages_with_keys if x['code_count'] == 1)
+    single_count = sum(1 for x in pages_with_keys if x.sort_bucket == 0)
     multiple_count = len(pages_with_keys) - single_count
     
     print(f"\nSorted {len(pages_with_keys)} pages:")
     print(f"  - Single occurrence codes (sorted A-Z): {single_count}")
     print(f"  - Multiple occurrence codes (sorted A-Z): {multiple_count}")
     
-    # Create the combined PDF
+    # Create the combined PDF, copying each run of consecutive pages from
+    # the same file with a single append() call
     writer = PdfWriter()
     
-    for item in pages_with_keys:
-        writer.add_page(item['page'])
-    
-    # Write the output
-    with open(output_path, 'wb') as output_file:
+    for _, run in groupby(pages_with_keys, key=attrgetter('source')):
+        run = list(run)
+        if len(run) == 1:
+            writer.add_page(run[0].page)
+        else:
+            writer.append(run[0].reader, pages=[item.page_num - 1 for item in run],
+                          import_outline=False)
+    
+    # Write the output through a 4 MB buffer rather than the default 8 KB,
+    # so a large combined PDF takes far fewer write calls
+    with open(output_path, 'wb', buffering=1 << 22) as output_file:
         writer.write(output_file)
     
     print(f"Combined PDF saved to: {output_path}")
@@ -223,28 +403,22 @@ def create_excel_spreadsheet(folder_path, code_counter, verbose=False):
     print("=" * 80)
     
     try:
-        # Create a new workbook
-        wb = Workbook()
-        sheet = wb.active
-        sheet.title = "Code Counts"
+        # Create a new workbook; xlsxwriter streams the file out rather
+        # than building every cell in memory first
+        wb = xlsxwriter.Workbook(excel_path)
+        sheet = wb.add_worksheet("Code Counts")
         
         # Add header row
-        sheet['A1'] = 'Code'
-        sheet['D1'] = 'Count'
-        
-        # Style header
-        header_font = Font(bold=True)
-        sheet['A1'].font = header_font
-        sheet['D1'].font = header_font
-        sheet['A1'].alignment = Alignment(horizontal='center')
-        sheet['D1'].alignment = Alignment(horizontal='center')
+        header_format = wb.add_format({'bold': True, 'align': 'center'})
+        sheet.write('A1', 'Code', header_format)
+        sheet.write('D1', 'Count', header_format)
         
         # Add data rows (sorted alphabetically by code)
         row = 2
         for code in sorted(code_counter.keys()):
             count = code_counter[code]
-            sheet[f'A{row}'] = code
-            sheet[f'D{row}'] = count
+            sheet.write(f'A{row}', code)
+            sheet.write(f'D{row}', count)
             
             if verbose:
                 print(f"  Row {row}: {code} = {count}")
@@ -252,11 +426,11 @@ def create_excel_spreadsheet(folder_path, code_counter, verbose=False):
             row += 1
         
         # Adjust column widths
-        sheet.column_dimensions['A'].width = 15
-        sheet.column_dimensions['D'].width = 12
+        sheet.set_column('A:A', 15)
+        sheet.set_column('D:D', 12)
         
         # Save the workbook
-        wb.save(excel_path)
+        wb.close()
         
         print(f"\nSpreadsheet created successfully:")
         print(f"  - Total codes: {len(code_counter)}")
@@ -318,7 +492,13 @@ def main():
     print("\n" + "=" * 80)
     print("STEP 1: Counting three-letter codes from all PDFs")
     print("=" * 80)
-    code_counter = count_codes_in_folder(folder_path, verbose)
+    # Read every PDF once; the codes and pages found feed all later steps
+    all_pdfs, combinable_pdfs = discover_pdfs(folder_path)
+    if not all_pdfs:
+        print(f"No PDF files found in {folder_path}")
+    readers = {}
+    pages = collect_pages(all_pdfs, combinable_pdfs, readers, verbose)
+    code_counter = Counter(p['code'] for p in pages if p['code'])
     print_code_results(code_counter)
     
     # Create Excel spreadsheet
@@ -332,7 +512,11 @@ def main():
     print("STEP 3: Combining PDFs alphabetically by code")
     print("=" * 80)
     output_path = os.path.join(folder_path, "combined_single_page(print).pdf")
-    num_pages = combine_pdfs_alphabetically(folder_path, output_path, code_counter, verbose)
+    num_pages = combine_pdfs_alphabetically(pages, combinable_pdfs, output_path, code_counter, verbose)
+    
+    # The combined PDF is written, so the source readers can be released
+    for reader in readers.values():
+        reader.close()
     
     print(f"\n{'=' * 80}")
     print("COMPLETE!")
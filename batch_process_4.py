@@ -8,14 +8,25 @@ Processes multiple PDF files in a folder to:
 """
 
 import pdfplumber
+import logging
 from pypdf import PdfReader, PdfWriter
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
+import xlsxwriter
 import sys
 import os
 import re
-from collections import Counter
-from pathlib import Path
+from collections import Counter, namedtuple
+from itertools import groupby
+from operator import attrgetter
+
+# pdfminer (used by pdfplumber) logs warnings for many real-world PDFs;
+# handling them is slow and only clutters the output
+for _logger_name in ("pdfminer", "pdfplumber"):
+    logging.getLogger(_logger_name).setLevel(logging.ERROR)
+
+# One page of the combined PDF: its sort key (bucket 0 for codes that occur
+# once, else 1, then the lowercased code) and where the page comes from.
+# A namedtuple is much smaller than a dict per page.
+PageRec = namedtuple('PageRec', 'sort_bucket code_key page reader source page_num')
 
 def extract_three_letter_code(line):
     """
@@ -46,34 +57,57 @@ def get_first_line(page):
                 return line.strip()
     return ""
 
-def count_codes_in_folder(folder_path, verbose=False):
+def list_pdf_files(folder_path):
+    """
+    List the PDFs in a folder, sorted by path.
+    
+    Args:
+        folder_path: Path to the folder containing PDFs
+        
+    Returns:
+        List of PDF paths. Sorting by os.path.normcase keeps the
+        case-insensitive order Path.glob gave on Windows.
+    """
+    # scandir() gives each entry's name without a stat or Path object per file
+    with os.scandir(folder_path) as entries:
+        return sorted((e.path for e in entries
+                       if e.is_file() and e.name.lower().endswith('.pdf')),
+                      key=os.path.normcase)
+
+def count_codes_in_folder(folder_path, verbose=False, code_map=None, failed_files=None):
     """
     Count three-letter codes from all PDFs in a folder.
     
     Args:
         folder_path: Path to the folder containing PDFs
         verbose: If True, print details about each file
+        code_map: Optional dict, filled with the code found on each page
+            (or None) keyed by (filename, page_num)
+        failed_files: Optional dict, filled with the error message for each
+            file that could not be read, keyed by filename
         
     Returns:
         Counter object with code counts
     """
-    code_counter = Counter()
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
+    codes = []
+    pdf_files = list_pdf_files(folder_path)
     
     if not pdf_files:
         print(f"No PDF files found in {folder_path}")
-        return code_counter
+        return Counter()
     
     print(f"Found {len(pdf_files)} PDF file(s)")
     print("=" * 80)
     
-    for pdf_file in sorted(pdf_files):
-        print(f"\nProcessing: {pdf_file.name}")
+    for pdf_file in pdf_files:
+        name = os.path.basename(pdf_file)
+        print(f"\nProcessing: {name}")
         
         try:
             with pdfplumber.open(pdf_file) as pdf:
                 for page_num, page in enumerate(pdf.pages, start=1):
                     text = page.extract_text()
+                    code = None
                     
                     if text:
                         lines = text.split('\n')
@@ -89,19 +123,25 @@ def count_codes_in_folder(folder_path, verbose=False):
                             code = extract_three_letter_code(last_line)
                             
                             if code:
-                                code_counter[code] += 1
+                                codes.append(code)
                                 if verbose:
                                     print(f"  Page {page_num}: Found code '{code}'")
                             elif verbose:
                                 print(f"  Page {page_num}: No code found in: {last_line}")
+                    
+                    if code_map is not None:
+                        code_map[(name, page_num)] = code
         
         except Exception as e:
-            print(f"  Error processing {pdf_file.name}: {e}")
+            print(f"  Error processing {name}: {e}")
+            if failed_files is not None:
+                failed_files[name] = str(e)
     
     print("=" * 80)
-    return code_counter
+    # Counting in one call is cheaper than updating the Counter per page
+    return Counter(codes)
 
-def combine_pdfs_alphabetically(folder_path, code_counter, verbose=False):
+def combine_pdfs_alphabetically(folder_path, code_counter, code_map, failed_files, verbose=False):
     """
     Combine PDFs from a folder, sorted alphabetically by 3-character code.
     Pages with code count of 1 appear first, then pages with higher counts.
@@ -112,16 +152,20 @@ def combine_pdfs_alphabetically(folder_path, code_counter, verbose=False):
     Args:
         folder_path: Path to the folder containing PDFs
         code_counter: Counter object with code counts
+        code_map: Code of each page keyed by (filename, page_num), as filled
+            in by count_codes_in_folder
+        failed_files: Error message of each file that could not be read
+            while counting, keyed by filename; these files are left out
         verbose: If True, print details about each page
         
     Returns:
         Number of pages in combined PDF
     """
-    pdf_files = list(Path(folder_path).glob('*.pdf'))
+    pdf_files = list_pdf_files(folder_path)
     
     # Separate multi-page files from files to combine
-    multi_page_files = [f for f in pdf_files if "multi-page" in f.name.lower()]
-    files_to_combine = [f for f in pdf_files if "multi-page" not in f.name.lower()]
+    multi_page_files = [f for f in pdf_files if "multi-page" in os.path.basename(f).lower()]
+    files_to_combine = [f for f in pdf_files if "multi-page" not in os.path.basename(f).lower()]
     
     if not files_to_combine:
         print("No PDF files to combine (after filtering)")
@@ -135,71 +179,72 @@ def combine_pdfs_alphabetically(folder_path, code_counter, verbose=False):
     print(f"\nCombining {len(files_to_combine)} PDF file(s) (excluding 'multi-page' files)")
     print("=" * 80)
     
-    # Store pages with their code for sorting
+    # Store pages with their sort key precomputed
     pages_with_keys = []
     
-    for pdf_file in sorted(files_to_combine):
+    for pdf_file in files_to_combine:
+        name = os.path.basename(pdf_file)
         if verbose:
-            print(f"Reading: {pdf_file.name}")
+            print(f"Reading: {name}")
+        
+        # A file that failed while counting has no codes in code_map
+        if name in failed_files:
+            print(f"Error reading {name}: {failed_files[name]}")
+            continue
         
         try:
-            # Use pdfplumber to extract text for sorting
-            with pdfplumber.open(pdf_file) as plumber_pdf:
-                # Use pypdf to get the actual pages for combining
-                pypdf_reader = PdfReader(pdf_file)
+            # The codes were found while counting, so only pypdf is needed
+            # here to get the actual pages for combining
+            pypdf_reader = PdfReader(pdf_file)
+            
+            for page_num, pypdf_page in enumerate(pypdf_reader.pages, start=1):
+                code = code_map.get((name, page_num))
                 
-                for page_num, plumber_page in enumerate(plumber_pdf.pages):
-                    # Get the last line to extract the code
-                    text = plumber_page.extract_text()
-                    code = None
-                    
-                    if text:
-                        lines = text.split('\n')
-                        # Get last non-empty line
-                        for line in reversed(lines):
-                            if line.strip():
-                                code = extract_three_letter_code(line.strip())
-                                break
-                    
-                    pypdf_page = pypdf_reader.pages[page_num]
-                    
-                    # Get the count for this code
-                    code_count = code_counter.get(code, 0) if code else 0
-                    
-                    pages_with_keys.append({
-                        'code': code if code else '',
-                        'code_count': code_count,
-                        'page': pypdf_page,
-                        'source': pdf_file.name,
-                        'page_num': page_num + 1
-                    })
-                    
-                    if verbose:
-                        print(f"  Page {page_num + 1}: Code '{code}' (count: {code_count})")
+                # Get the count for this code
+                code_count = code_counter.get(code, 0) if code else 0
+                
+                pages_with_keys.append(PageRec(
+                    sort_bucket=0 if code_count == 1 else 1,
+                    code_key=code.lower() if code else '',
+                    page=pypdf_page,
+                    reader=pypdf_reader,
+                    source=name,
+                    page_num=page_num
+                ))
+                
+                if verbose:
+                    print(f"  Page {page_num}: Code '{code}' (count: {code_count})")
         
         except Exception as e:
-            print(f"Error reading {pdf_file.name}: {e}")
+            print(f"Error reading {name}: {e}")
     
     # Sort pages: first by whether count is 1 (single occurrences first),
     # then alphabetically by code (case-insensitive)
-    pages_with_keys.sort(key=lambda x: (0 if x['code_count'] == 1 else 1, x['code'].lower()))
+    pages_with_keys.sort(key=attrgetter('sort_bucket', 'code_key'))
     
-    single_count = sum(1 for x in pages_with_keys if x['code_count'] == 1)
+    single_count = sum(1 for x in pages_with_keys if x.sort_bucket == 0)
     multiple_count = len(pages_with_keys) - single_count
     
     print(f"\nSorted {len(pages_with_keys)} pages:")
     print(f"  - Single occurrence codes (sorted A-Z): {single_count}")
     print(f"  - Multiple occurrence codes (sorted A-Z): {multiple_count}")
     
-    # Create the combined PDF
+    # Create the combined PDF, copying each run of consecutive pages from
+    # the same file with a single append() call
     writer = PdfWriter()
     
-    for item in pages_with_keys:
-        writer.add_page(item['page'])
+    for _, run in groupby(pages_with_keys, key=attrgetter('source')):
+        run = list(run)
+        if len(run) == 1:
+            writer.add_page(run[0].page)
+        else:
+            writer.append(run[0].reader, pages=[item.page_num - 1 for item in run],
+                          import_outline=False)
     
     # Write the output to "Print these" folder
     output_path = os.path.join(print_folder, "combined_alphabetical.pdf")
-    with open(output_path, 'wb') as output_file:
+    # A 4 MB buffer rather than the default 8 KB means far fewer write calls
+    with open(output_path, 'wb', buffering=1 << 22) as output_file:
         writer.write(output_file)
     
     print(f"Combined PDF saved to: {output_path}")
@@ -209,9 +254,10 @@ def combine_pdfs_alphabetically(folder_path, code_counter, verbose=False):
         print(f"\nCopying {len(multi_page_files)} multi-page file(s) to 'Print these' folder:")
         for multi_page_file in multi_page_files:
             import shutil
-            dest_path = os.path.join(print_folder, multi_page_file.name)
+            name = os.path.basename(multi_page_file)
+            dest_path = os.path.join(print_folder, name)
             shutil.copy2(multi_page_file, dest_path)
-            print(f"  - Copied: {multi_page_file.name}")
+            print(f"  - Copied: {name}")
     
     print("=" * 80)
     
@@ -240,28 +286,22 @@ def create_excel_spreadsheet(folder_path, code_counter, verbose=False):
     print("=" * 80)
     
     try:
-        # Create a new workbook
-        wb = Workbook()
-        sheet = wb.active
-        sheet.title = "Code Counts"
+        # Create a new workbook; xlsxwriter streams the file out rather
+        # than building every cell in memory first
+        wb = xlsxwriter.Workbook(excel_path)
+        sheet = wb.add_worksheet("Code Counts")
         
         # Add header row
-        sheet['A1'] = 'Code'
-        sheet['D1'] = 'Count'
-        
-        # Style header
-        header_font = Font(bold=True)
-        sheet['A1'].font = header_font
-        sheet['D1'].font = header_font
-        sheet['A1'].alignment = Alignment(horizontal='center')
-        sheet['D1'].alignment = Alignment(horizontal='center')
+        header_format = wb.add_format({'bold': True, 'align': 'center'})
+        sheet.write('A1', 'Code', header_format)
+        sheet.write('D1', 'Count', header_format)
         
         # Add data rows (sorted alphabetically by code)
         row = 2
         for code in sorted(code_counter.keys()):
             count = code_counter[code]
-            sheet[f'A{row}'] = code
-            sheet[f'D{row}'] = count
+            sheet.write(f'A{row}', code)
+            sheet.write(f'D{row}', count)
             
             if verbose:
                 print(f"  Row {row}: {code} = {count}")
@@ -269,11 +309,11 @@ def create_excel_spreadsheet(folder_path, code_counter, verbose=False):
             row += 1
         
         # Adjust column widths
-        sheet.column_dimensions['A'].width = 15
-        sheet.column_dimensions['D'].width = 12
+        sheet.set_column('A:A', 15)
+        sheet.set_column('D:D', 12)
         
         # Save the workbook
-        wb.save(excel_path)
+        wb.close()
         
         print(f"\nSpreadsheet created successfully:")
         print(f"  - Total codes: {len(code_counter)}")
@@ -338,7 +378,10 @@ def main():
     print("\n" + "=" * 80)
     print("STEP 1: Counting three-letter codes from all PDFs")
     print("=" * 80)
-    code_counter = count_codes_in_folder(folder_path, verbose)
+    # Remember each page's code so combining doesn't extract the text again
+    code_map = {}
+    failed_files = {}
+    code_counter = count_codes_in_folder(folder_path, verbose, code_map, failed_files)
     print_code_results(code_counter)
     
     # Create Excel spreadsheet
@@ -351,7 +394,7 @@ def main():
     print("\n" + "=" * 80)
     print("STEP 3: Combining PDFs and organizing files for printing")
     print("=" * 80)
-    num_pages = combine_pdfs_alphabetically(folder_path, code_counter, verbose)
+    num_pages = combine_pdfs_alphabetically(folder_path, code_counter, code_map, failed_files, verbose)
     
     print(f"\n{'=' * 80}")
     print("COMPLETE!")
@@ -6,10 +6,15 @@ Expected format: "xxx MM/DD/YY cccc" where xxx is the 3-letter code to count.
 """
 
 import pdfplumber
+import logging
 import sys
-import re
 from collections import Counter
 
+# pdfminer (used by pdfplumber) logs warnings for many real-world PDFs;
+# handling them is slow and only clutters the output
+for _logger_name in ("pdfminer", "pdfplumber"):
+    logging.getLogger(_logger_name).setLevel(logging.ERROR)
+
 def extract_three_letter_code(line):
     """
     Extract the three-letter code from a line.
@@ -21,14 +26,33 @@ def extract_three_letter_code(line):
     Returns:
         The three-letter code if found, None otherwise
     """
-    # Pattern: 3 characters (letters/numbers), space, date, space, 4 characters
-    # This pattern is flexible to handle variations
-    pattern = r'^([a-zA-Z0-9]{3})\s+\d{1,2}/\d{1,2}/\d{2,4}\s+[a-zA-Z]{4}\s*$'
+    # Most lines are not codes, so reject them with cheap checks first.
+    # The shortest possible match, "xxx M/D/YY cccc", is 15 chars.
+    line = line.strip()
+    if len(line) < 15 or '/' not in line:
+        return None
+    
+    # The layout is fixed, so check it field by field rather than with a regex
+    parts = line.split()
+    if len(parts) != 3:
+        return None
+    
+    code, date, tail = parts
+    if len(code) != 3 or not (code.isascii() and code.isalnum()):
+        return None
+    if len(tail) != 4 or not (tail.isascii() and tail.isalpha()):
+        return None
     
-    match = re.match(pattern, line.strip())
-    if match:
-        return match.group(1)
-    return None
+    # Month and day are 1-2 digits, the year 2-4 digits
+    fields = date.split('/')
+    if len(fields) != 3:
+        return None
+    month, day, year = fields
+    if not (1 <= len(month) <= 2 and 1 <= len(day) <= 2 and 2 <= len(year) <= 4):
+        return None
+    if not (month.isdecimal() and day.isdecimal() and year.isdecimal()):
+        return None
+    return code
 
 def count_codes_in_pdf(pdf_path, verbose=False):
     """
@@ -41,7 +65,7 @@ def count_codes_in_pdf(pdf_path, verbose=False):
     Returns:
         Counter object with code counts
     """
-    code_counter = Counter()
+    codes = []
     
     try:
         with pdfplumber.open(pdf_path) as pdf:
@@ -69,7 +93,7 @@ def count_codes_in_pdf(pdf_path, verbose=False):
                         code = extract_three_letter_code(last_line)
                         
                         if code:
-                            code_counter[code] += 1
+                            codes.append(code)
                             if verbose:
                                 print(f"Page {page_num}: Found code '{code}' in line: {last_line}")
                         else:
@@ -91,7 +115,8 @@ def count_codes_in_pdf(pdf_path, verbose=False):
         print(f"Error reading PDF: {e}")
         sys.exit(1)
     
-    return code_counter
+    # Counting in one call is cheaper than updating the Counter per page
+    return Counter(codes)
 
 def print_results(code_counter):
     """Print the results in a formatted way."""
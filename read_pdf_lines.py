@@ -5,8 +5,14 @@ Reads a PDF file and prints its content line by line for analysis.
 """
 
 import pdfplumber
+import logging
 import sys
 
+# pdfminer (used by pdfplumber) logs warnings for many real-world PDFs;
+# handling them is slow and only clutters the output
+for _logger_name in ("pdfminer", "pdfplumber"):
+    logging.getLogger(_logger_name).setLevel(logging.ERROR)
+
 def read_pdf_lines(pdf_path):
     """
     Read a PDF file and print its content line by line.